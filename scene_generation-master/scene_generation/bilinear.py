@@ -226,7 +226,7 @@ def bilinear_sample(feats, X, Y):
 
     # Actually use gather to pull out the values from feats corresponding
     # to our four samples, then reshape them to (BB, C, HH, WW)
-    feats_flat = feats.view(N, C, H * W)
+    feats_flat = feats.reshape(N, C, H * W)
     v1 = feats_flat.gather(2, y0x0_idx.long()).view(N, C, HH, WW)
     v2 = feats_flat.gather(2, y1x0_idx.long()).view(N, C, HH, WW)
     v3 = feats_flat.gather(2, y0x1_idx.long()).view(N, C, HH, WW)
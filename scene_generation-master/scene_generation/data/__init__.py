@@ -1,2 +1,2 @@
 from .utils import imagenet_preprocess, imagenet_deprocess
-from .utils import imagenet_deprocess_batch
+from .utils import imagenet_deprocess_batch, imagenet_deprocess_batch_uint8
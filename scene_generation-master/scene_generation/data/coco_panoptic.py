@@ -23,7 +23,8 @@ class CocoPanopticSceneGraphDataset(Dataset):
                  min_object_size=0.02,
                  min_objects_per_image=3, max_objects_per_image=8,
                  include_other=False, instance_whitelist=None, stuff_whitelist=None, include_sentences=False,
-                 captions_json=None, no__img__=False, sample_attributes=False, val_part=False, grid_size=25):
+                 captions_json=None, no__img__=False, sample_attributes=False, val_part=False, grid_size=25,
+                 load_images=True):
         """
         A PyTorch Dataset for loading Coco and Coco-Stuff annotations and converting
         them to scene graphs on the fly.
@@ -54,6 +55,8 @@ class CocoPanopticSceneGraphDataset(Dataset):
           list giving a whitelist of instance category names to use.
         - stuff_whitelist: None means use all stuff categories. Otherwise a list
           giving a whitelist of stuff category names to use.
+        - load_images: If False, skip decoding images and return an empty
+          image tensor; useful when images are decoded elsewhere (e.g. DALI).
         """
         super(Dataset, self).__init__()
 
@@ -65,6 +68,7 @@ class CocoPanopticSceneGraphDataset(Dataset):
         self.mask_size = mask_size
         self.max_samples = max_samples
         self.normalize_images = normalize_images
+        self.load_images = load_images
         self.include_sentence = include_sentences
         self.set_image_size(image_size)
         self.no__img__ = no__img__
@@ -330,7 +334,10 @@ class CocoPanopticSceneGraphDataset(Dataset):
         with open(image_path, 'rb') as f:
             with PIL.Image.open(f) as image:
                 WW, HH = image.size
-                image = self.transform(image.convert('RGB'))
+                if self.load_images:
+                    image = self.transform(image.convert('RGB'))
+                else:
+                    image = torch.zeros(0)
 
         H, W = self.image_size
         objs, boxes, masks = [], [], []
@@ -51,6 +51,24 @@ def imagenet_deprocess_batch(imgs, rescale=True):
     return imgs_de
 
 
+def imagenet_deprocess_batch_uint8(imgs, rescale=True):
+    """
+    Same as imagenet_deprocess_batch, but runs on the device of imgs and
+    returns a ByteTensor of shape (N, C, H, W) on that device.
+    """
+    imgs = unpack_var(imgs)
+    N, C = imgs.size(0), imgs.size(1)
+    mean = torch.tensor(IMAGENET_MEAN, dtype=imgs.dtype, device=imgs.device).view(1, C, 1, 1)
+    std = torch.tensor(IMAGENET_STD, dtype=imgs.dtype, device=imgs.device).view(1, C, 1, 1)
+    imgs_de = imgs * std + mean
+    if rescale:
+        flat = imgs_de.reshape(N, -1)
+        lo = flat.min(dim=1)[0].view(N, 1, 1, 1)
+        hi = flat.max(dim=1)[0].view(N, 1, 1, 1)
+        imgs_de.sub_(lo).div_(hi - lo)
+    return imgs_de.mul_(255).clamp_(0, 255).to(torch.uint8)
+
+
 class Resize(object):
     def __init__(self, size, interp=PIL.Image.BILINEAR):
         if isinstance(size, tuple):
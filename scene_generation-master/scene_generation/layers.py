@@ -60,7 +60,7 @@ def _init_conv(layer, method):
 
 class Flatten(nn.Module):
     def forward(self, x):
-        return x.view(x.size(0), -1)
+        return x.reshape(x.size(0), -1)
 
     def __repr__(self):
         return 'Flatten()'
@@ -82,7 +82,7 @@ class Unflatten(nn.Module):
 class GlobalAvgPool(nn.Module):
     def forward(self, x):
         N, C = x.size(0), x.size(1)
-        return x.view(N, C, -1).mean(dim=2)
+        return x.reshape(N, C, -1).mean(dim=2)
 
 
 class ResidualBlock(nn.Module):
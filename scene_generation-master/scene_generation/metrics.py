@@ -32,4 +32,4 @@ def jaccard(bbox_pred, bbox_gt):
                                                  bbox_gt[:, 1])
     union = area_pred + area_gt - inter
     iou = torch.div(inter, union)
-    return torch.sum(iou), (iou > 0.5).sum().item(), (iou > 0.3).sum().item()
+    return torch.sum(iou), (iou > 0.5).sum(), (iou > 0.3).sum()
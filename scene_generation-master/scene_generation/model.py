@@ -92,12 +92,13 @@ class Model(nn.Module):
         self.pix2pix = define_G(netG_input_nc, output_nc, ngf, n_downsample_global, n_blocks_global, norm)
 
     def forward(self, gt_imgs, objs, triples, obj_to_img, boxes_gt=None, masks_gt=None, attributes=None,
-                gt_train=False, test_mode=False, use_gt_box=False, features=None):
+                gt_train=False, test_mode=False, use_gt_box=False, features=None, features_valid=None):
         O, T = objs.size(0), triples.size(0)
         obj_vecs, pred_vecs = self.scene_graph_to_vectors(objs, triples, attributes)
 
         box_vecs, mask_vecs, scene_layout_vecs, wrong_layout_vecs = \
-            self.create_components_vecs(gt_imgs, boxes_gt, obj_to_img, objs, obj_vecs, gt_train, features)
+            self.create_components_vecs(gt_imgs, boxes_gt, obj_to_img, objs, obj_vecs, gt_train, features,
+                                        features_valid)
 
         # Generate Boxes
         boxes_pred = self.box_net(box_vecs)
@@ -142,7 +143,8 @@ class Model(nn.Module):
 
         return obj_vecs, pred_vecs
 
-    def create_components_vecs(self, imgs, boxes, obj_to_img, objs, obj_vecs, gt_train, features):
+    def create_components_vecs(self, imgs, boxes, obj_to_img, objs, obj_vecs, gt_train, features,
+                               features_valid=None):
         O = objs.size(0)
         box_vecs = obj_vecs
         mask_vecs = obj_vecs
@@ -158,7 +160,13 @@ class Model(nn.Module):
         else:
             obj_repr = self.repr_net(mask_vecs)
         # Only in inference time
-        if features is not None:
+        if torch.is_tensor(features):
+            # features_valid marks the rows of features to use; others keep the prediction
+            features = features.to(obj_repr.dtype)
+            if features_valid is not None:
+                features = torch.where(features_valid.view(-1, 1), features, obj_repr)
+            obj_repr = features
+        elif features is not None:
             for ind, feature in enumerate(features):
                 if feature is not None:
                     obj_repr[ind, :] = feature
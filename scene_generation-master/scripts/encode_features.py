@@ -142,7 +142,7 @@ def main(opt):
     ############## Clustering ###########
     print('begin clustering')
     load_name = os.path.join(save_path, name + '.npy')
-    features = np.load(load_name).item()
+    features = np.load(load_name, allow_pickle=True).item()
     cluster(features, num_objs, 100, save_path)
     cluster(features, num_objs, 10, save_path)
     cluster(features, num_objs, 1, save_path)
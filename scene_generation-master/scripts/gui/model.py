@@ -51,7 +51,7 @@ def get_model():
     # print(features_path)
     # features = None
     if os.path.isfile(features_path):
-        features = np.load(features_path).item()
+        features = np.load(features_path, allow_pickle=True).item()
     else:
         features = None
     model = Model(**checkpoint['model_kwargs'])
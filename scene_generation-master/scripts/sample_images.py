@@ -1,15 +1,20 @@
 import argparse
+import multiprocessing
 import os
-from random import randint
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import torch
-from scipy.misc import imsave
+import torch.nn.functional as F
+from PIL import Image
 from torch.utils.data import DataLoader
+from torchvision.io import write_png
 
-from scene_generation.data import imagenet_deprocess_batch
+from scene_generation.data import imagenet_deprocess_batch_uint8
 from scene_generation.data.coco_panoptic import CocoPanopticSceneGraphDataset, coco_collate_fn
-from scene_generation.data.utils import split_graph_batch
+from scene_generation.data.utils import IMAGENET_MEAN, IMAGENET_STD, split_graph_batch
 from scene_generation.vis import draw_scene_graph
 from scene_generation.metrics import jaccard
 from scene_generation.model import Model
@@ -26,6 +31,8 @@ parser.add_argument('--image_size', default=(128, 128), type=int_tuple)
 parser.add_argument('--batch_size', default=24, type=int)
 parser.add_argument('--shuffle', default=False, type=bool_flag)
 parser.add_argument('--loader_num_workers', default=4, type=int)
+parser.add_argument('--preload_gpu', default=False, type=bool_flag)
+parser.add_argument('--use_dali', default=False, type=bool_flag)
 parser.add_argument('--num_samples', default=10000, type=int)
 parser.add_argument('--save_gt_imgs', default=False, type=bool_flag)
 parser.add_argument('--save_graphs', default=False, type=bool_flag)
@@ -34,14 +41,25 @@ parser.add_argument('--use_gt_masks', default=False, type=bool_flag)
 parser.add_argument('--use_gt_attr', default=False, type=bool_flag)
 parser.add_argument('--use_gt_textures', default=False, type=bool_flag)
 parser.add_argument('--save_layout', default=False, type=bool_flag)
+parser.add_argument('--png_compress_level', default=1, type=int)
+parser.add_argument('--soft_layout', default=False, type=bool_flag)
 parser.add_argument('--sample_attributes', default=False, type=bool_flag)
 parser.add_argument('--sample_features', default=False, type=bool_flag)
 parser.add_argument('--best_first_part', default=False, type=bool_flag)
 parser.add_argument('--object_size', default=64, type=int)
+parser.add_argument('--use_amp', default=False, type=bool_flag,
+                    help='Run the model in bf16/fp16; the printed box IoU/recall then come from '
+                         'reduced-precision box predictions.')
+parser.add_argument('--compile_model', default=False, type=bool_flag)
 parser.add_argument('--grid_size', default=25, type=int)
 
 parser.add_argument('--output_dir', default='output')
 
+# Fraction of free GPU memory the --preload_gpu dataset may take up
+GPU_PRELOAD_MEM_FRACTION = 0.5
+# Number of queued PNG writes after which sampling waits for the encoders
+MAX_PENDING_WRITES = 256
+
 COCO_DIR = os.path.expanduser('../data/coco')
 parser.add_argument('--coco_image_dir',
                     default=os.path.join(COCO_DIR, 'images/val2017'))
@@ -51,7 +69,7 @@ parser.add_argument('--stuff_json',
                     default=os.path.join(COCO_DIR, 'annotations/stuff_val2017.json'))
 
 
-def build_coco_dset(args, checkpoint):
+def build_coco_dset(args, checkpoint, load_images=True):
     checkpoint_args = checkpoint['args']
     print('include other: ', checkpoint_args.get('coco_include_other'))
     dset_kwargs = {
@@ -70,14 +88,16 @@ def build_coco_dset(args, checkpoint):
         'include_other': checkpoint_args.get('coco_include_other', True),
         'val_part': False,
         'sample_attributes': args.sample_attributes,
-        'grid_size': args.grid_size
+        'grid_size': args.grid_size,
+        'load_images': load_images,
     }
     dset = CocoPanopticSceneGraphDataset(**dset_kwargs)
     return dset
 
 
-def build_loader(args, checkpoint):
-    dset = build_coco_dset(args, checkpoint)
+def build_loader(args, checkpoint, dset=None):
+    if dset is None:
+        dset = build_coco_dset(args, checkpoint)
     collate_fn = coco_collate_fn
 
     loader_kwargs = {
@@ -85,11 +105,149 @@ def build_loader(args, checkpoint):
         'num_workers': args.loader_num_workers,
         'shuffle': args.shuffle,
         'collate_fn': collate_fn,
+        'pin_memory': True,
     }
+    if args.loader_num_workers > 0:
+        loader_kwargs['persistent_workers'] = True
+        loader_kwargs['prefetch_factor'] = 4
     loader = DataLoader(dset, **loader_kwargs)
     return loader
 
 
+class CUDAPrefetcher(object):
+    """
+    Wraps a loader so that the host-to-device copy of the next batch is issued
+    on a side CUDA stream while the current batch is being processed.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.stream = torch.cuda.Stream()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        loader_iter = iter(self.loader)
+        batch = self._preload(loader_iter)
+        while batch is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            for x in batch:
+                x.record_stream(current_stream)
+            next_batch = self._preload(loader_iter)
+            yield batch
+            batch = next_batch
+
+    def _preload(self, loader_iter):
+        try:
+            batch = next(loader_iter)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return [x.cuda(non_blocking=True) for x in batch]
+
+
+class DALICocoLoader(object):
+    """
+    Zips GPU-decoded images from a DALI iterator with the scene graph tensors
+    from a DataLoader over the same images in the same order.
+    """
+
+    def __init__(self, dali_iter, graph_loader):
+        self.dali_iter = dali_iter
+        self.graph_loader = graph_loader
+
+    def __len__(self):
+        return len(self.graph_loader)
+
+    def __iter__(self):
+        for dali_out, graph_batch in zip(self.dali_iter, self.graph_loader):
+            # DALI gives NHWC; the permuted view is NCHW in channels_last layout
+            imgs = dali_out[0]['imgs'].permute(0, 3, 1, 2)
+            yield (imgs,) + tuple(graph_batch[1:])
+        self.dali_iter.reset()
+
+
+def build_dali_loader(args, checkpoint):
+    from nvidia.dali import fn, pipeline_def, types
+    from nvidia.dali.plugin.base_iterator import LastBatchPolicy
+    from nvidia.dali.plugin.pytorch import DALIGenericIterator
+
+    dset = build_coco_dset(args, checkpoint, load_images=False)
+    files = [os.path.join(dset.image_dir, dset.image_id_to_filename[dset.image_ids[i]])
+             for i in range(len(dset))]
+    H, W = args.image_size
+
+    @pipeline_def
+    def coco_image_pipeline():
+        jpegs, _ = fn.readers.file(files=files, random_shuffle=False, name='Reader')
+        images = fn.decoders.image(jpegs, device='mixed', output_type=types.RGB)
+        images = fn.resize(images, resize_x=W, resize_y=H)
+        return fn.crop_mirror_normalize(images, dtype=types.FLOAT, output_layout='HWC',
+                                        mean=[255.0 * m for m in IMAGENET_MEAN],
+                                        std=[255.0 * s for s in IMAGENET_STD])
+
+    pipe = coco_image_pipeline(batch_size=args.batch_size, num_threads=max(1, args.loader_num_workers),
+                               device_id=torch.cuda.current_device())
+    pipe.build()
+    dali_iter = DALIGenericIterator(pipe, ['imgs'], reader_name='Reader',
+                                    last_batch_policy=LastBatchPolicy.PARTIAL)
+
+    graph_loader = build_loader(args, checkpoint, dset)
+    return DALICocoLoader(dali_iter, graph_loader)
+
+
+class GPUPreloadedLoader(object):
+    """
+    Holds a whole collated dataset in GPU memory and yields batches as
+    contiguous slices of it, in dataset order.
+    """
+
+    def __init__(self, data, batch_size):
+        self.data = data
+        self.batch_size = batch_size
+        imgs, objs, _, _, triples, obj_to_img, triple_to_img, _ = data
+        self.num_imgs = imgs.size(0)
+        obj_counts = torch.bincount(obj_to_img.cpu(), minlength=self.num_imgs)
+        triple_counts = torch.bincount(triple_to_img.cpu(), minlength=self.num_imgs)
+        self.obj_offsets = [0] + torch.cumsum(obj_counts, 0).tolist()
+        self.triple_offsets = [0] + torch.cumsum(triple_counts, 0).tolist()
+
+    def __len__(self):
+        return (self.num_imgs + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        imgs, objs, boxes, masks, triples, obj_to_img, triple_to_img, attributes = self.data
+        for start in range(0, self.num_imgs, self.batch_size):
+            end = min(start + self.batch_size, self.num_imgs)
+            o0, o1 = self.obj_offsets[start], self.obj_offsets[end]
+            t0, t1 = self.triple_offsets[start], self.triple_offsets[end]
+            cur_triples = triples[t0:t1].clone()
+            cur_triples[:, 0] -= o0
+            cur_triples[:, 2] -= o0
+            yield (imgs[start:end], objs[o0:o1], boxes[o0:o1], masks[o0:o1], cur_triples,
+                   obj_to_img[o0:o1] - start, triple_to_img[t0:t1] - start, attributes[o0:o1])
+
+
+def build_gpu_loader(args, dset):
+    """
+    Collate the whole dataset once and move it to the GPU. Returns None if the
+    estimated size of the collated tensors is more than GPU_PRELOAD_MEM_FRACTION
+    of the currently free GPU memory; the rest is left for activations.
+    """
+    sample = coco_collate_fn([dset[0]])
+    num_bytes = sum(x.numel() * x.element_size() for x in sample) * len(dset)
+    free_bytes, _ = torch.cuda.mem_get_info()
+    if num_bytes > GPU_PRELOAD_MEM_FRACTION * free_bytes:
+        print('Dataset needs about %d bytes but only %d are free on the GPU, '
+              'falling back to DataLoader' % (num_bytes, free_bytes))
+        return None
+    data = coco_collate_fn([dset[i] for i in range(len(dset))])
+    data = tuple(x.cuda() for x in data)
+    return GPUPreloadedLoader(data, args.batch_size)
+
+
 def build_model(args, checkpoint):
     kwargs = checkpoint['model_kwargs']
     model = Model(**kwargs)
@@ -101,6 +259,12 @@ def build_model(args, checkpoint):
         model.train()
     model.image_size = args.image_size
     model.cuda()
+    model = model.to(memory_format=torch.channels_last)
+    torch.backends.cudnn.benchmark = True
+    if args.compile_model:
+        # Object counts change every batch, so compile with dynamic shapes and
+        # without CUDA graphs
+        model = torch.compile(model, mode='default', dynamic=True)
     return model
 
 
@@ -113,126 +277,223 @@ def makedir(base, name, flag=True):
     return dir_name
 
 
-def one_hot_to_rgb(layout_pred, colors, num_objs):
+def render_and_save_graph(objs, triples, vocab, path, compress_level=1):
+    ff, tmp_filename = tempfile.mkstemp(suffix='.png')
+    os.close(ff)
+    graph_img = draw_scene_graph(objs, triples, vocab, output_filename=tmp_filename)
+    Image.fromarray(graph_img).save(path, optimize=False, compress_level=compress_level)
+
+
+def one_hot_to_rgb(layout_pred, color_weight, num_objs):
+    one_hot_3d = F.conv2d(layout_pred[:, :num_objs, :, :], color_weight)
+    one_hot_3d.mul_(255.0 / one_hot_3d.max())
+    return one_hot_3d.clamp_(0, 255).to(torch.uint8)
+
+
+def one_hot_to_palette(layout_pred, palette, num_objs):
     one_hot = layout_pred[:, :num_objs, :, :]
-    one_hot_3d = torch.einsum('abcd,be->aecd', [one_hot.cpu(), colors])
-    one_hot_3d *= (255.0 / one_hot_3d.max())
-    return one_hot_3d
+    classes = one_hot.argmax(dim=1)
+    # Pixels no object covers stay black instead of taking class 0's colour
+    empty = (one_hot.amax(dim=1) <= 0).unsqueeze(-1)
+    return palette[classes].masked_fill_(empty, 0).permute(0, 3, 1, 2)
+
+
+def build_feature_table(features, num_classes):
+    """
+    Pack a {obj_idx: ndarray of shape (K, D)} dict of clustered features into
+    a zero-padded FloatTensor of shape (num_classes, max_K, D) and a
+    LongTensor of shape (num_classes,) giving the number of valid rows.
+    Classes missing from the dict get a count of 0.
+    """
+    if max(features.keys()) >= num_classes:
+        raise ValueError('Features file has object index %d but the model only has %d objects'
+                         % (max(features.keys()), num_classes))
+    max_k = max(f.shape[0] for f in features.values())
+    D = next(iter(features.values())).shape[1]
+    feat_table = torch.zeros(num_classes, max_k, D, dtype=torch.float32, pin_memory=True)
+    feat_counts = torch.zeros(num_classes, dtype=torch.long, pin_memory=True)
+    for obj_idx, obj_feature in features.items():
+        feat_table[obj_idx, :obj_feature.shape[0]].copy_(torch.from_numpy(obj_feature))
+        feat_counts[obj_idx] = obj_feature.shape[0]
+    return feat_table.cuda(non_blocking=True), feat_counts.cuda(non_blocking=True)
+
+
+def drain_futures(futures, max_pending=0):
+    """
+    Re-raise errors from finished write jobs and block on the oldest pending
+    ones until at most max_pending remain. Returns the still pending futures.
+    """
+    pending = []
+    for f in futures:
+        if f.done():
+            f.result()
+        else:
+            pending.append(f)
+    while len(pending) > max_pending:
+        pending.pop(0).result()
+    return pending
 
 
 def run_model(args, checkpoint, output_dir, loader=None):
+    if args.preload_gpu and args.shuffle:
+        raise ValueError('--preload_gpu iterates the dataset in order and does not support --shuffle')
+    if args.use_dali and args.shuffle:
+        raise ValueError('--use_dali iterates the dataset in order and does not support --shuffle')
+    if args.use_dali and args.preload_gpu:
+        raise ValueError('--use_dali and --preload_gpu cannot be used together')
     dirname = os.path.dirname(args.checkpoint)
     features = None
     if args.sample_features:
         features_path = os.path.join(dirname, 'features_clustered_001.npy')
         print(features_path)
         if os.path.isfile(features_path):
-            features = np.load(features_path).item()
+            features = np.load(features_path, allow_pickle=True).item()
         else:
             raise ValueError('No features file')
-    with torch.no_grad():
-        vocab = checkpoint['model_kwargs']['vocab']
-        model = build_model(args, checkpoint)
-        if loader is None:
-            loader = build_loader(args, checkpoint)
-
-        img_dir = makedir(output_dir, 'images')
-        graph_dir = makedir(output_dir, 'graphs', args.save_graphs)
-        gt_img_dir = makedir(output_dir, 'images_gt', args.save_gt_imgs)
-        layout_dir = makedir(output_dir, 'layouts', args.save_layout)
-
-        img_idx = 0
-        total_iou = 0
-        total_boxes = 0
-        r_05 = 0
-        r_03 = 0
-        num_objs = model.num_objs
-        colors = torch.randint(0, 256, [num_objs, 3]).float()
-        for batch in loader:
-            imgs, objs, boxes, masks, triples, obj_to_img, triple_to_img, attributes = [x.cuda() for x in batch]
-
-            imgs_gt = imagenet_deprocess_batch(imgs)
-            masks_gt = None
-            gt_train = False
-
-            if args.use_gt_masks:
-                masks_gt = masks
-            if args.use_gt_textures:
-                gt_train = True
-            if not args.use_gt_attr:
-                attributes = torch.zeros_like(attributes)
-
+    executor = ThreadPoolExecutor(max_workers=max(1, args.loader_num_workers))
+    futures = []
+    graph_pool = None
+    if args.save_graphs:
+        # The pool starts after CUDA and the writer/loader threads, so don't fork
+        graph_pool = ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with torch.no_grad():
+            vocab = checkpoint['model_kwargs']['vocab']
+            model = build_model(args, checkpoint)
             if features is not None:
-                all_features = []
-                for obj_name in objs:
-                    obj_feature = features[obj_name.item()]
-                    random_index = randint(0, obj_feature.shape[0] - 1)
-                    feat = torch.from_numpy(obj_feature[random_index, :]).type(torch.float32).cuda()
-                    all_features.append(feat)
-            else:
-                all_features = None
-            # Run the model with predicted masks
-            model_out = model(imgs, objs, triples, obj_to_img, boxes_gt=boxes, masks_gt=masks_gt, attributes=attributes,
-                              gt_train=gt_train, test_mode=True, use_gt_box=args.use_gt_boxes, features=all_features)
-            imgs_pred, boxes_pred, masks_pred, _, layout, _ = model_out
-
-            iou, bigger_05, bigger_03 = jaccard(boxes_pred, boxes)
-            total_iou += iou
-            r_05 += bigger_05
-            r_03 += bigger_03
-            total_boxes += boxes_pred.size(0)
-            imgs_pred = imagenet_deprocess_batch(imgs_pred)
-
-            obj_data = [objs, boxes_pred, masks_pred]
-            _, obj_data = split_graph_batch(triples, obj_data, obj_to_img, triple_to_img)
-            objs, boxes_pred, masks_pred = obj_data
-
-            obj_data_gt = [boxes.data]
-            if masks is not None:
-                obj_data_gt.append(masks.data)
-            triples, obj_data_gt = split_graph_batch(triples, obj_data_gt, obj_to_img, triple_to_img)
-            boxes_gt, masks_gt = obj_data_gt[0], None
-            if masks is not None:
-                masks_gt = obj_data_gt[1]
-            layouts_3d = one_hot_to_rgb(layout, colors, num_objs)
-            for i in range(imgs_pred.size(0)):
-                img_filename = '%04d.png' % img_idx
-                if args.save_gt_imgs:
-                    img_gt = imgs_gt[i].numpy().transpose(1, 2, 0)
-                    img_gt_path = os.path.join(gt_img_dir, img_filename)
-                    imsave(img_gt_path, img_gt)
-                if args.save_layout:
-                    layout_3d = layouts_3d[i].numpy().transpose(1, 2, 0)
-                    layout_path = os.path.join(layout_dir, img_filename)
-                    imsave(layout_path, layout_3d)
-
-                img_pred_np = imgs_pred[i].numpy().transpose(1, 2, 0)
-                img_path = os.path.join(img_dir, img_filename)
-                imsave(img_path, img_pred_np)
-
-                cur_masks_gt = None
-                if masks_gt is not None:
-                    cur_masks_gt = masks_gt[i].cpu().clone()
+                feat_table, feat_counts = build_feature_table(features, model.num_objs)
+            dset = None
+            if loader is None and args.preload_gpu and args.dataset == 'coco':
+                dset = build_coco_dset(args, checkpoint)
+                loader = build_gpu_loader(args, dset)
+            if loader is None and args.use_dali and args.dataset == 'coco':
+                loader = build_dali_loader(args, checkpoint)
+            if loader is None:
+                loader = build_loader(args, checkpoint, dset)
+
+            img_dir = makedir(output_dir, 'images')
+            graph_dir = makedir(output_dir, 'graphs', args.save_graphs)
+            gt_img_dir = makedir(output_dir, 'images_gt', args.save_gt_imgs)
+            layout_dir = makedir(output_dir, 'layouts', args.save_layout)
+
+            img_idx = 0
+            total_iou = torch.zeros((), device='cuda')
+            total_boxes = 0
+            r_05 = torch.zeros((), dtype=torch.long, device='cuda')
+            r_03 = torch.zeros((), dtype=torch.long, device='cuda')
+            num_objs = model.num_objs
+            colors = torch.randint(0, 256, [num_objs, 3]).float().cuda()
+            palette = colors.to(torch.uint8)
+            color_weight = colors.t().reshape(3, num_objs, 1, 1)
+            zero_attributes = None
+            needs_warm_up = args.compile_model
+            amp_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            for batch in CUDAPrefetcher(loader):
+                imgs, objs, boxes, masks, triples, obj_to_img, triple_to_img, attributes = batch
+                imgs = imgs.to(memory_format=torch.channels_last)
+
+                masks_gt = None
+                gt_train = False
+
+                if args.use_gt_masks:
+                    masks_gt = masks
+                if args.use_gt_textures:
+                    gt_train = True
+                if not args.use_gt_attr:
+                    if zero_attributes is None or zero_attributes.size(0) < attributes.size(0):
+                        zero_attributes = torch.zeros_like(attributes)
+                    attributes = zero_attributes[:attributes.size(0)]
+
+                features_valid = None
+                if features is not None:
+                    obj_counts = feat_counts[objs]
+                    random_index = (torch.rand(objs.size(0), device=objs.device) * obj_counts.float()).long()
+                    all_features = feat_table[objs, random_index]
+                    features_valid = obj_counts > 0
+                else:
+                    all_features = None
+                # Run the model with predicted masks
+                model_kwargs = {
+                    'boxes_gt': boxes,
+                    'masks_gt': masks_gt,
+                    'attributes': attributes,
+                    'gt_train': gt_train,
+                    'test_mode': True,
+                    'use_gt_box': args.use_gt_boxes,
+                    'features': all_features,
+                    'features_valid': features_valid,
+                }
+                with torch.autocast('cuda', dtype=amp_dtype, enabled=args.use_amp):
+                    if needs_warm_up:
+                        print('Compiling model')
+                        model(imgs, objs, triples, obj_to_img, **model_kwargs)
+                        needs_warm_up = False
+                    model_out = model(imgs, objs, triples, obj_to_img, **model_kwargs)
+                imgs_pred, boxes_pred, masks_pred, _, layout, _ = model_out
+                imgs_pred, boxes_pred, masks_pred, layout = \
+                    imgs_pred.float(), boxes_pred.float(), masks_pred.float(), layout.float()
+
+                iou, bigger_05, bigger_03 = jaccard(boxes_pred, boxes)
+                total_iou += iou
+                r_05 += bigger_05
+                r_03 += bigger_03
+                total_boxes += boxes_pred.size(0)
+                imgs_pred = imagenet_deprocess_batch_uint8(imgs_pred)
 
                 if args.save_graphs:
-                    graph_img = draw_scene_graph(objs[i], triples[i], vocab)
-                    graph_path = os.path.join(graph_dir, img_filename)
-                    imsave(graph_path, graph_img)
-
-                img_idx += 1
-
-            print('Saved %d images' % img_idx)
-        avg_iou = total_iou / total_boxes
-        print(avg_iou)
-        print('r0.5 {}'.format(r_05 / total_boxes))
-        print('r0.3 {}'.format(r_03 / total_boxes))
+                    triples, (objs,) = split_graph_batch(triples, [objs], obj_to_img, triple_to_img)
+                imgs_pred_cpu = imgs_pred.contiguous().cpu()
+                if args.save_gt_imgs:
+                    imgs_gt_cpu = imagenet_deprocess_batch_uint8(imgs).contiguous().cpu()
+                if args.save_layout:
+                    if args.soft_layout:
+                        layouts_3d = one_hot_to_rgb(layout, color_weight, num_objs)
+                    else:
+                        layouts_3d = one_hot_to_palette(layout, palette, num_objs)
+                    layouts_3d_cpu = layouts_3d.contiguous().cpu()
+                for i in range(imgs_pred.size(0)):
+                    img_filename = '%04d.png' % img_idx
+                    if args.save_gt_imgs:
+                        img_gt_path = os.path.join(gt_img_dir, img_filename)
+                        futures.append(executor.submit(write_png, imgs_gt_cpu[i], img_gt_path,
+                                                       compression_level=args.png_compress_level))
+                    if args.save_layout:
+                        layout_path = os.path.join(layout_dir, img_filename)
+                        futures.append(executor.submit(write_png, layouts_3d_cpu[i], layout_path,
+                                                       compression_level=args.png_compress_level))
+
+                    img_path = os.path.join(img_dir, img_filename)
+                    futures.append(executor.submit(write_png, imgs_pred_cpu[i], img_path,
+                                                   compression_level=args.png_compress_level))
+
+                    if args.save_graphs:
+                        graph_path = os.path.join(graph_dir, img_filename)
+                        futures.append(graph_pool.submit(render_and_save_graph, objs[i].cpu(), triples[i].cpu(),
+                                                         vocab, graph_path, args.png_compress_level))
+
+                    img_idx += 1
+
+                futures = drain_futures(futures, MAX_PENDING_WRITES)
+                print('Saved %d images' % img_idx)
+            futures = drain_futures(futures)
+            avg_iou = total_iou.item() / total_boxes
+            print(avg_iou)
+            print('r0.5 {}'.format(r_05.item() / total_boxes))
+            print('r0.3 {}'.format(r_03.item() / total_boxes))
+    finally:
+        executor.shutdown()
+        if graph_pool is not None:
+            graph_pool.shutdown()
 
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    if args.checkpoint is not None:
+    if args.checkpoint is None:
         raise ValueError('Must specify --checkpoint')
 
-    checkpoint = torch.load(args.checkpoint)
     print('Loading model from ', args.checkpoint)
+    # mmap only works for checkpoints saved in torch's zipfile format, not the
+    # legacy format older checkpoints use
+    use_mmap = zipfile.is_zipfile(args.checkpoint)
+    checkpoint = torch.load(args.checkpoint, map_location='cuda', mmap=use_mmap)
     run_model(args, checkpoint, args.output_dir)